@@ -1,93 +1,224 @@
 import argparse
 import logging
+import signal
 import subprocess  # nosec B404
 import sys
+import threading
 import time
-from typing import Optional
-
-import numpy as np
-import sounddevice as sd
+from functools import cache
+from typing import TYPE_CHECKING, Callable, Optional
 
 from mic_control.utils import validate_log_path
 
+# numpy and sounddevice (which loads PortAudio) are imported where they're
+# used, so --help and argument errors don't pay for loading them
+if TYPE_CHECKING:
+    import numpy as np
+    import sounddevice as sd
 
-def set_mic_volume(
-    volume,
-) -> bool:
-    """Set the microphone input volume (0-100)."""
-    try:
-        cmd = f"osascript -e 'set volume input volume {volume}'"
-        subprocess.run(
-            cmd,
-            shell=True,  # nosec B602
-            check=True,
-        )
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to set volume: {e}")
-        return False
+# Runs osascript; ensure_mic_volume() accepts a replacement for testing
+Runner = Callable[..., subprocess.CompletedProcess]
 
+_OSASCRIPT = "/usr/bin/osascript"
 
-def get_mic_volume() -> Optional[int]:
-    """Get current microphone input volume."""
+# Shortest delay between call detection checks after a call state change
+MIN_CALL_INTERVAL = 2
+
+# Seconds to trust the last known volume before checking it again during a call
+VOLUME_VERIFY_PERIOD = 30
+
+# Audio is captured as 16-bit integers; thresholds are given relative to full scale
+SAMPLE_DTYPE = "int16"
+SAMPLE_FULL_SCALE = 32767
+
+# Seconds a recording may run over its length before the device counts as failed
+READ_TIMEOUT = 2
+
+# Seconds between checks for newly captured audio while recording
+READ_POLL_INTERVAL = 0.05
+
+
+@cache
+def _ensure_volume_cmd(volume) -> tuple[str, ...]:
+    """Build the osascript command line for ensure_mic_volume().
+
+    The target volume doesn't change while running, so it's only built once.
+    """
+    return (
+        _OSASCRIPT,
+        "-e",
+        "set previousVolume to input volume of (get volume settings)",
+        "-e",
+        f"if previousVolume is not {volume} then set volume input volume {volume}",
+        "-e",
+        "return previousVolume",
+    )
+
+
+def ensure_mic_volume(
+    volume,
+    runner: Runner = subprocess.run,
+) -> Optional[int]:
+    """Set the microphone input volume (0-100) unless it's already at that level.
+
+    Reads and sets the volume in a single osascript call and returns the
+    volume found before any change, or None if the call failed.
+    """
     try:
-        cmd = "osascript -e 'input volume of (get volume settings)'"
-        result = subprocess.run(
-            cmd,
-            shell=True,  # nosec B602
+        result = runner(
+            _ensure_volume_cmd(volume),
             capture_output=True,
             text=True,
             check=True,
         )
         return int(result.stdout.strip())
     except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to get volume: {e}")
+        logging.error("Failed to adjust volume: %s", e)
         return None
 
 
+def open_input_stream() -> "sd.InputStream":
+    """Open an input stream on the default microphone, started by record()."""
+    import sounddevice as sd
+
+    device_info = sd.query_devices(kind="input")
+    sample_rate = int(device_info["default_samplerate"])
+
+    return sd.InputStream(
+        samplerate=sample_rate,
+        channels=1,
+        dtype=SAMPLE_DTYPE,
+        blocksize=1024,
+        latency="low",
+    )
+
+
+def reset_input_stream(stream: "Optional[sd.InputStream]") -> None:
+    """Close a failed input stream and rescan the audio devices.
+
+    Rescanning relies on sounddevice's private _terminate() and _initialize(),
+    as it has no public way to restart PortAudio.
+    """
+    import sounddevice as sd
+
+    if stream is not None:
+        stream.close()
+
+    # PortAudio only lists the devices when it's initialized, so restart it
+    # to see devices added or removed since, including a new default device
+    try:
+        sd._terminate()
+        sd._initialize()
+    except Exception as e:
+        logging.error("Failed to rescan audio devices: %s", e)
+
+
+def record(
+    stream: "sd.InputStream",
+    frames: int,
+    stop_event: Optional[threading.Event] = None,
+) -> "Optional[np.ndarray]":
+    """Record frames from the input stream, running it only while recording.
+
+    Returns None if the stop event is set first, and raises sd.PortAudioError
+    if the device fails or stops delivering audio.
+    """
+    import numpy as np
+    import sounddevice as sd
+
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    recording = np.empty((frames, 1), dtype=SAMPLE_DTYPE)
+    position = 0
+    deadline = time.monotonic() + frames / stream.samplerate + READ_TIMEOUT
+
+    # Starting the stream for each recording keeps the microphone in use
+    # indicator off in between, and skips audio buffered while stopped
+    stream.start()
+    try:
+        while position < frames:
+            if stop_event.is_set():
+                return None
+
+            # Only read what's already captured, since a blocking read can't be
+            # interrupted and never returns if the device stops delivering audio
+            available = min(stream.read_available, frames - position)
+            if available:
+                block, _ = stream.read(available)
+                end = position + available
+                recording[position:end] = block
+                position = end
+            elif time.monotonic() > deadline:
+                raise sd.PortAudioError("Timed out waiting for audio from the input device")
+            else:
+                stop_event.wait(READ_POLL_INTERVAL)
+    finally:
+        stream.stop()
+
+    return recording
+
+
+def active_windows(windows: "np.ndarray", threshold: float) -> "np.ndarray":
+    """Return which rows of a (windows, samples) recording have RMS above the threshold."""
+    import numpy as np
+
+    # RMS > threshold is the same as sum of squares > threshold² * n,
+    # which needs a single reduction and no sqrt or division. The squares
+    # are accumulated as int64 so the int16 samples can't overflow.
+    sums = np.einsum("ij,ij->i", windows, windows, dtype=np.int64)
+    return sums > (threshold * SAMPLE_FULL_SCALE) ** 2 * windows.shape[1]
+
+
 def is_audio_active(
+    stream: "sd.InputStream",
     threshold=0.01,
     duration=1.0,
 ) -> bool:
     """Check if there's significant audio activity on the microphone."""
     try:
-        # Get default input device
-        device_info = sd.query_devices(kind="input")
-        sample_rate = int(device_info["default_samplerate"])
-
-        # Record audio for specified duration
-        recording = sd.rec(
-            int(duration * sample_rate),
-            channels=1,
-            dtype="float32",
-            samplerate=sample_rate,
-        )
-        sd.wait()
-
-        # Calculate RMS value
-        rms = np.sqrt(np.mean(recording**2))
-
-        return rms > threshold
+        # Record audio for the specified duration, as a single window
+        recording = record(stream, int(duration * stream.samplerate))
+        return bool(active_windows(recording.reshape(1, -1), threshold)[0])
 
     except Exception as e:
-        logging.error(f"Error detecting audio: {e}")
+        logging.error("Error detecting audio: %s", e)
         return False
 
 
 def detect_call_activity(
+    stream: "sd.InputStream",
     audio_check_duration=5,
+    threshold=0.01,
+    stop_event: Optional[threading.Event] = None,
 ) -> bool:
-    """Detect if we're likely in a call by monitoring audio activity over time."""
-    audio_samples = []
+    """Detect if we're likely in a call by monitoring audio activity over time.
 
-    # Take several samples over a period
-    for _ in range(audio_check_duration):
-        audio_samples.append(is_audio_active())
-        time.sleep(1)
+    Input device errors are raised as sd.PortAudioError, so the caller can
+    reopen the stream.
+    """
+    import numpy as np
+    import sounddevice as sd
+
+    try:
+        # Capture the whole check period in one recording and split it into
+        # one-second windows, each of which counts as a sample
+        window = int(stream.samplerate)
+        recording = record(stream, audio_check_duration * window, stop_event)
+        if recording is None:
+            return False
+        windows = recording.reshape(audio_check_duration, window)
+        audio_samples = active_windows(windows, threshold)
+
+    except sd.PortAudioError:
+        raise
+    except Exception as e:
+        logging.error("Error detecting audio: %s", e)
+        return False
 
     # If we detect audio activity in at least 40% of samples,
     # we're probably in a call
-    return sum(audio_samples) / len(audio_samples) >= 0.4
+    return bool(np.count_nonzero(audio_samples) / audio_samples.size >= 0.4)
 
 
 def parse_args() -> argparse.Namespace:
@@ -120,7 +251,7 @@ def parse_args() -> argparse.Namespace:
         "--call-interval",
         type=int,
         default=30,
-        help="Seconds between full call detection checks (default: 30)",
+        help="Maximum seconds between full call detection checks (default: 30)",
         metavar="SECONDS",
     )
     parser.add_argument(
@@ -133,6 +264,98 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def control_loop(
+    args: argparse.Namespace,
+    stream: "sd.InputStream",
+    stop_event: threading.Event,
+) -> None:
+    """Keep the microphone at the target volume while in a call, until stopped.
+
+    Takes ownership of the input stream, and replaces it if the device fails.
+    """
+    import sounddevice as sd
+
+    min_call_interval = min(MIN_CALL_INTERVAL, args.call_interval)
+    call_interval = min_call_interval
+    next_call_check = time.monotonic()
+    in_call = False
+    known_volume = None
+    last_volume_check = 0.0
+    next_tick = time.monotonic()
+
+    try:
+        while not stop_event.is_set():
+            # Periodically do a full call detection check
+            if time.monotonic() >= next_call_check:
+                was_in_call = in_call
+                try:
+                    if stream is None:
+                        stream = open_input_stream()
+                    in_call = detect_call_activity(stream, stop_event=stop_event)
+                except sd.PortAudioError as e:
+                    # The device is probably gone, keep the last call state and
+                    # soon open a stream on the current default device
+                    logging.error("Input device failed, reopening it: %s", e)
+                    reset_input_stream(stream)
+                    stream = None
+                    next_call_check = time.monotonic() + min_call_interval
+                else:
+                    # Check again soon after a state change, back off while it's stable
+                    if in_call == was_in_call:
+                        call_interval = min(call_interval * 1.5, args.call_interval)
+                    else:
+                        call_interval = min_call_interval
+                        # The volume may have been changed outside of a call
+                        known_volume = None
+                        # Act on the new state now instead of at the next tick
+                        next_tick = time.monotonic()
+                    next_call_check = time.monotonic() + call_interval
+
+                    logging.info("Call status check: %s", "in call" if in_call else "not in call")
+
+            # Check the volume every active (in a call) or idle interval
+            if time.monotonic() >= next_tick:
+                # Skip the osascript call while the volume is known to be on target
+                volume_check_due = (
+                    known_volume != args.target_volume
+                    or time.monotonic() - last_volume_check >= VOLUME_VERIFY_PERIOD
+                )
+
+                if in_call and volume_check_due:
+                    previous_volume = ensure_mic_volume(args.target_volume)
+                    last_volume_check = time.monotonic()
+
+                    if previous_volume is None:
+                        known_volume = None
+                    else:
+                        known_volume = args.target_volume
+
+                        if previous_volume != args.target_volume:
+                            logging.info(
+                                "In call: Adjusted volume from %s to %s",
+                                previous_volume,
+                                args.target_volume,
+                            )
+
+                # Schedule from the last tick rather than from now, so the work
+                # done here doesn't push the schedule back
+                interval = args.active_interval if in_call else args.idle_interval
+                next_tick += interval
+                now = time.monotonic()
+                if next_tick <= now:
+                    # The iteration overran its tick, restart the schedule from now
+                    next_tick = now + interval
+
+            # Wait until the next tick or call check, whichever is due first.
+            # The wait ends early when the stop event is set.
+            delay = min(next_tick, next_call_check) - time.monotonic()
+            if delay > 0:
+                stop_event.wait(delay)
+    finally:
+        if stream is not None:
+            stream.close()
+
+
 def main() -> None:
     args = parse_args()
 
@@ -157,38 +380,44 @@ def main() -> None:
 
     # Log the configuration
     logging.info(
-        f"Starting microphone level controller with settings:\n"
-        f"- Target Volume: {args.target_volume}\n"
-        f"- Active Check Interval: {args.active_interval}s\n"
-        f"- Idle Check Interval: {args.idle_interval}s\n"
-        f"- Call Check Interval: {args.call_interval}s\n"
-        f"- Log Path: {log_path}"
+        "Starting microphone level controller with settings:\n"
+        "- Target Volume: %s\n"
+        "- Active Check Interval: %ss\n"
+        "- Idle Check Interval: %ss\n"
+        "- Max Call Check Interval: %ss\n"
+        "- Log Path: %s",
+        args.target_volume,
+        args.active_interval,
+        args.idle_interval,
+        args.call_interval,
+        log_path,
     )
 
-    last_call_check = 0
-    in_call = False
+    # Open the input stream up front, so a missing microphone fails at startup
+    try:
+        stream = open_input_stream()
+    except Exception as e:
+        logging.error("Failed to open input stream: %s", e)
+        sys.exit(1)
 
-    while True:
-        current_time = time.time()
+    # Wake the control loop as soon as we're asked to stop, instead of
+    # letting it finish its current wait
+    stop_event = threading.Event()
 
-        # Periodically do a full call detection check
-        if current_time - last_call_check > args.call_interval:
-            in_call = detect_call_activity()
-            last_call_check = current_time
-            logging.info(f"Call status check: {'in call' if in_call else 'not in call'}")
+    def handle_signal(signum, frame):
+        stop_event.set()
 
-        if in_call:
-            current_volume = get_mic_volume()
+    previous_handlers = {
+        signum: signal.signal(signum, handle_signal) for signum in (signal.SIGINT, signal.SIGTERM)
+    }
 
-            if current_volume is not None and current_volume != args.target_volume:
-                logging.info(
-                    f"In call: Adjusting volume from {current_volume} to {args.target_volume}"
-                )
-                set_mic_volume(args.target_volume)
+    try:
+        control_loop(args, stream, stop_event)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
 
-            time.sleep(args.active_interval)
-        else:
-            time.sleep(args.idle_interval)
+    logging.info("Stopped microphone level controller")
 
 
 if __name__ == "__main__":
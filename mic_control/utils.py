@@ -1,47 +1,58 @@
+import errno
 import os
+import stat
 import sys
 from pathlib import Path
 
 
+def _open_for_append(log_path: Path) -> bool:
+    """Open the log file for appending, creating it if needed, and close it again.
+
+    Returns whether it's a regular file. The open doesn't block, so a FIFO
+    without a reader fails with ENXIO instead of waiting for one.
+    """
+    fd = os.open(log_path, os.O_CREAT | os.O_APPEND | os.O_WRONLY | os.O_NONBLOCK, 0o644)
+    try:
+        return stat.S_ISREG(os.fstat(fd).st_mode)
+    finally:
+        os.close(fd)
+
+
 def validate_log_path(log_path: str) -> Path:
     """Validate the log file path and ensure it's usable."""
     try:
         # Convert to Path object and resolve any relative paths
         log_path = Path(log_path).resolve()
 
-        # Check if parent directory exists, if not try to create it
-        if not log_path.parent.exists():
+        # Open the file the same way the log handler will and let the error
+        # tell us what's wrong, instead of checking each condition up front
+        try:
             try:
-                log_path.parent.mkdir(parents=True, exist_ok=True)
-            except PermissionError:
-                sys.exit(f"Error: No permission to create directory: {log_path.parent}")
-            except OSError as e:
-                sys.exit(f"Error: Could not create directory {log_path.parent}: {e}")
-
-        # Check if parent directory is actually a directory
-        if not log_path.parent.is_dir():
+                is_regular_file = _open_for_append(log_path)
+            except FileNotFoundError:
+                # Parent directory doesn't exist, try to create it
+                try:
+                    log_path.parent.mkdir(parents=True, exist_ok=True)
+                except PermissionError:
+                    sys.exit(f"Error: No permission to create directory: {log_path.parent}")
+                except OSError as e:
+                    sys.exit(f"Error: Could not create directory {log_path.parent}: {e}")
+
+                is_regular_file = _open_for_append(log_path)
+        except IsADirectoryError:
+            sys.exit(f"Error: {log_path} exists but is not a regular file")
+        except NotADirectoryError:
             sys.exit(f"Error: {log_path.parent} exists but is not a directory")
-
-        # Check directory permissions
-        if not os.access(log_path.parent, os.R_OK | os.W_OK | os.X_OK):
-            sys.exit(f"Error: Insufficient permissions for directory: {log_path.parent}")
-
-        # If log file exists, check if it's a regular file and writable
-        if log_path.exists():
-            if not log_path.is_file():
+        except PermissionError:
+            sys.exit(f"Error: No write permission for log file: {log_path}")
+        except OSError as e:
+            # Opening a FIFO for writing fails like this when nothing reads from it
+            if e.errno == errno.ENXIO:
                 sys.exit(f"Error: {log_path} exists but is not a regular file")
-            if not os.access(log_path, os.W_OK):
-                sys.exit(f"Error: No write permission for existing log file: {log_path}")
-        else:
-            # Check if we can create the file by trying to open it
-            try:
-                with open(log_path, "a"):
-                    pass
-                log_path.unlink()  # Remove the test file
-            except PermissionError:
-                sys.exit(f"Error: No permission to create log file: {log_path}")
-            except OSError as e:
-                sys.exit(f"Error: Could not create log file {log_path}: {e}")
+            sys.exit(f"Error: Could not open log file {log_path}: {e}")
+
+        if not is_regular_file:
+            sys.exit(f"Error: {log_path} exists but is not a regular file")
 
         return log_path
 
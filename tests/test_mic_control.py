@@ -1,123 +1,455 @@
-import subprocess  # nosec B404
-from unittest.mock import Mock, patch
+import logging
+import threading
+from argparse import Namespace
+from itertools import chain, repeat
+from subprocess import CalledProcessError  # nosec B404
+from types import SimpleNamespace
+from unittest.mock import DEFAULT, Mock, patch
 
 import numpy as np
 import pytest
 
+from mic_control import __main__ as mic_control_main
 from mic_control.__main__ import (
+    active_windows,
+    control_loop,
     detect_call_activity,
-    get_mic_volume,
+    ensure_mic_volume,
     is_audio_active,
-    set_mic_volume,
+    open_input_stream,
+    record,
+    reset_input_stream,
 )
 
 
 @pytest.fixture
-def mock_subprocess():
-    with patch("subprocess.run") as mock_run:
-        yield mock_run
+def mock_runner():
+    return Mock()
 
 
 @pytest.fixture
 def mock_sounddevice():
-    with patch("sounddevice.query_devices") as mock_query:
-        with patch("sounddevice.rec") as mock_rec:
-            with patch("sounddevice.wait") as mock_wait:
-                mock_query.return_value = {"default_samplerate": 44100}
-                yield mock_query, mock_rec, mock_wait
-
-
-def test_set_mic_volume_success(mock_subprocess):
-    mock_subprocess.return_value = Mock(returncode=0)
-    assert set_mic_volume(50) is True
-    mock_subprocess.assert_called_once_with(
-        "osascript -e 'set volume input volume 50'",
-        shell=True,
-        check=True,
-    )
+    with patch.multiple("sounddevice", query_devices=DEFAULT, InputStream=DEFAULT) as mocks:
+        mocks["query_devices"].return_value = {"default_samplerate": 44100}
+        yield mocks["query_devices"], mocks["InputStream"]
+
+
+def _int16(levels):
+    """Convert sample levels relative to full scale into an int16 recording."""
+    return (np.array(levels) * 32767).astype(np.int16)
+
+
+# Volume boundaries; the runner fails for invalid volumes outside 0-100 to
+# simulate an osascript error, osascript itself clamps them
+_VOLUME_CASES = tuple(
+    pytest.param(volume, expected, id=f"vol-{volume}")
+    for volume, expected in ((0, True), (50, True), (100, True), (-1, False), (101, False))
+)
+
 
+# Recordings that produce RMS above and below the default 0.01 threshold
+_LOUD = _int16([[0.1], [0.2], [0.3]])
+_QUIET = _int16([[0.001], [0.002], [0.001]])
 
-def test_set_mic_volume_failure(mock_subprocess):
-    mock_subprocess.side_effect = subprocess.CalledProcessError(1, "cmd")
-    assert set_mic_volume(50) is False
 
+def _mock_stream(recording, samplerate, available=None):
+    """Mock an input stream that serves the recording over consecutive reads.
 
-def test_get_mic_volume_success(mock_subprocess):
-    mock_subprocess.return_value = Mock(
+    Each read can take up to `available` frames, the whole recording by default.
+    """
+    position = 0
+
+    def read(frames):
+        nonlocal position
+        start, position = position, position + frames
+        return recording[start:position], False
+
+    return Mock(
+        samplerate=samplerate,
+        read_available=len(recording) if available is None else available,
+        read=Mock(side_effect=read),
+    )
+
+
+def test_ensure_mic_volume_success(mock_runner):
+    mock_runner.return_value = SimpleNamespace(
         returncode=0,
-        stdout="75\n",
+        stdout="60\n",
     )
-    assert get_mic_volume() == 75
-    mock_subprocess.assert_called_once_with(
-        "osascript -e 'input volume of (get volume settings)'",
-        shell=True,
+    assert ensure_mic_volume(80, runner=mock_runner) == 60
+    mock_runner.assert_called_once_with(
+        (
+            "/usr/bin/osascript",
+            "-e",
+            "set previousVolume to input volume of (get volume settings)",
+            "-e",
+            "if previousVolume is not 80 then set volume input volume 80",
+            "-e",
+            "return previousVolume",
+        ),
         capture_output=True,
         text=True,
         check=True,
     )
 
 
-def test_get_mic_volume_failure(mock_subprocess):
-    mock_subprocess.side_effect = subprocess.CalledProcessError(1, "cmd")
-    assert get_mic_volume() is None
+def test_ensure_mic_volume_reuses_command(mock_runner):
+    mock_runner.return_value = SimpleNamespace(returncode=0, stdout="80\n")
+
+    ensure_mic_volume(80, runner=mock_runner)
+    ensure_mic_volume(80, runner=mock_runner)
+
+    first, second = (c.args[0] for c in mock_runner.call_args_list)
+    assert second is first
+
+
+def test_ensure_mic_volume_failure(mock_runner):
+    mock_runner.side_effect = CalledProcessError(1, "cmd")
+    assert ensure_mic_volume(80, runner=mock_runner) is None
+
+
+def test_open_input_stream(mock_sounddevice):
+    mock_query, mock_input_stream = mock_sounddevice
+
+    assert open_input_stream() is mock_input_stream.return_value
+    mock_input_stream.assert_called_once_with(
+        samplerate=44100,
+        channels=1,
+        dtype="int16",
+        blocksize=1024,
+        latency="low",
+    )
+    mock_query.assert_called_once_with(kind="input")
+
+
+def test_reset_input_stream():
+    stream = Mock()
+
+    with patch.multiple("sounddevice", _terminate=DEFAULT, _initialize=DEFAULT) as mocks:
+        reset_input_stream(stream)
+
+    stream.close.assert_called_once_with()
+    mocks["_terminate"].assert_called_once_with()
+    mocks["_initialize"].assert_called_once_with()
+
+
+def test_reset_input_stream_rescan_error():
+    stream = Mock()
+
+    with patch.multiple("sounddevice", _terminate=DEFAULT, _initialize=DEFAULT) as mocks:
+        mocks["_initialize"].side_effect = Exception("PortAudio error")
+        # Logged instead of raised, so it can't stop the control loop
+        reset_input_stream(stream)
+
+    stream.close.assert_called_once_with()
+
+
+def test_record():
+    recording = np.arange(5, dtype=np.int16).reshape(-1, 1)
+    stream = _mock_stream(recording, samplerate=5, available=2)
+
+    np.testing.assert_array_equal(record(stream, 5), recording)
+    # Only reads what's available, and runs the stream just for the recording
+    assert [c.args[0] for c in stream.read.call_args_list] == [2, 2, 1]
+    stream.start.assert_called_once_with()
+    stream.stop.assert_called_once_with()
 
 
-def test_is_audio_active_success(mock_sounddevice):
-    _, mock_rec, _ = mock_sounddevice
-    # Simulate audio recording with values that will produce RMS > threshold
-    mock_rec.return_value = np.array([[0.1], [0.2], [0.3]])
+def test_record_stopped():
+    stream = _mock_stream(_QUIET, samplerate=3, available=0)
+    stop_event = threading.Event()
+    stop_event.set()
 
-    assert is_audio_active(threshold=0.01, duration=1.0)
+    assert record(stream, 3, stop_event) is None
+    stream.stop.assert_called_once_with()
 
 
-def test_is_audio_active_no_sound(mock_sounddevice):
-    _, mock_rec, _ = mock_sounddevice
-    # Simulate audio recording with values that will produce RMS < threshold
-    mock_rec.return_value = np.array([[0.001], [0.002], [0.001]])
+def test_record_timeout(monkeypatch):
+    import sounddevice as sd
 
-    assert not is_audio_active(threshold=0.01, duration=1.0)
+    monkeypatch.setattr(mic_control_main, "READ_TIMEOUT", 0)
+    # A device that stops delivering audio never has any frames available
+    stream = _mock_stream(_QUIET, samplerate=300, available=0)
 
+    with pytest.raises(sd.PortAudioError, match="Timed out"):
+        record(stream, 3)
+    stream.stop.assert_called_once_with()
 
-def test_is_audio_active_error(mock_sounddevice):
-    mock_query, _, _ = mock_sounddevice
-    mock_query.side_effect = Exception("Device error")
 
-    assert not is_audio_active()
+def test_active_windows():
+    windows = _int16([[0.1, -0.1], [0.001, -0.001], [0.01, 0.02]])
 
+    np.testing.assert_array_equal(active_windows(windows, threshold=0.01), [True, False, True])
 
-@patch("mic_control.__main__.is_audio_active")
-@patch("mic_control.__main__.time.sleep")
-def test_detect_call_activity_active(mock_sleep, mock_is_audio_active):
+
+def test_is_audio_active_success():
+    stream = _mock_stream(_LOUD, samplerate=3)
+
+    assert is_audio_active(stream, threshold=0.01, duration=1.0)
+
+
+def test_is_audio_active_no_sound():
+    stream = _mock_stream(_QUIET, samplerate=3)
+
+    assert not is_audio_active(stream, threshold=0.01, duration=1.0)
+
+
+def test_is_audio_active_error():
+    stream = _mock_stream(_QUIET, samplerate=3)
+    stream.read.side_effect = Exception("Device error")
+
+    assert not is_audio_active(stream)
+
+
+def _recording(*active, samplerate=4):
+    """Build a mono recording with one loud or silent second per entry."""
+    levels = [0.1 if is_active else 0.001 for is_active in active]
+    return _int16(np.repeat(levels, samplerate).reshape(-1, 1))
+
+
+def test_detect_call_activity_active():
     # Simulate 3 out of 5 samples being active (60% > 40% threshold)
-    mock_is_audio_active.side_effect = [True, True, True, False, False]
+    stream = _mock_stream(_recording(True, True, True, False, False), samplerate=4)
 
-    assert detect_call_activity(audio_check_duration=5) is True
-    assert mock_is_audio_active.call_count == 5
-    assert mock_sleep.call_count == 5
+    assert detect_call_activity(stream, audio_check_duration=5) is True
+    # The whole check period is captured in a single read
+    stream.read.assert_called_once_with(20)
 
 
-@patch("mic_control.__main__.is_audio_active")
-@patch("mic_control.__main__.time.sleep")
-def test_detect_call_activity_inactive(mock_sleep, mock_is_audio_active):
+def test_detect_call_activity_inactive():
     # Simulate 1 out of 5 samples being active (20% < 40% threshold)
-    mock_is_audio_active.side_effect = [True, False, False, False, False]
-
-    assert detect_call_activity(audio_check_duration=5) is False
-    assert mock_is_audio_active.call_count == 5
-    assert mock_sleep.call_count == 5
-
-
-@pytest.mark.parametrize(
-    "volume,expected",
-    [
-        (0, True),
-        (50, True),
-        (100, True),
-        (-1, False),  # Invalid volume
-        (101, False),  # Invalid volume
-    ],
-)
-def test_set_mic_volume_boundaries(mock_subprocess, volume, expected):
-    if not expected:
-        mock_subprocess.side_effect = subprocess.CalledProcessError(1, "cmd")
-    assert set_mic_volume(volume) is expected
+    stream = _mock_stream(_recording(True, False, False, False, False), samplerate=4)
+
+    assert detect_call_activity(stream, audio_check_duration=5) is False
+
+
+def test_detect_call_activity_error():
+    stream = _mock_stream(_recording(False), samplerate=4)
+    stream.read.side_effect = Exception("Device error")
+
+    assert detect_call_activity(stream) is False
+
+
+def test_detect_call_activity_device_error():
+    import sounddevice as sd
+
+    stream = _mock_stream(_recording(False), samplerate=4)
+    stream.read.side_effect = sd.PortAudioError("Device unavailable")
+
+    # Raised so the control loop can reopen the stream
+    with pytest.raises(sd.PortAudioError):
+        detect_call_activity(stream)
+
+
+def _loop_args():
+    return Namespace(target_volume=80, active_interval=3, idle_interval=15, call_interval=30)
+
+
+def _stop_after(iterations):
+    """Mock a stop event that is set after the given number of loop iterations."""
+    stop_event = Mock(spec=threading.Event)
+    # Stays set once set, so extra checks never exhaust the side effect
+    stop_event.is_set.side_effect = chain(repeat(False, iterations), repeat(True))
+    return stop_event
+
+
+@pytest.fixture
+def loop_env(monkeypatch):
+    """Replace the stream, call detection and volume functions used by the control loop."""
+    mocks = SimpleNamespace(
+        detect_call_activity=Mock(),
+        ensure_mic_volume=Mock(),
+        open_input_stream=Mock(),
+        reset_input_stream=Mock(),
+    )
+    for name, mock in vars(mocks).items():
+        monkeypatch.setattr(mic_control_main, name, mock)
+    return mocks
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the control loop's monotonic clock with one that only moves on waits."""
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(mic_control_main, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def _run_until(clock, end):
+    """Mock a stop event that advances the clock on waits and is set at the end time."""
+
+    def wait(timeout):
+        clock.now += timeout
+        return clock.now >= end
+
+    stop_event = Mock(spec=threading.Event)
+    stop_event.is_set.side_effect = lambda: clock.now >= end
+    stop_event.wait.side_effect = wait
+    return stop_event
+
+
+def _call_times(clock, mock, results):
+    """Make the mock return the results in turn, and collect the times it's called at."""
+    times = []
+    results = iter(results)
+
+    def side_effect(*args, **kwargs):
+        times.append(clock.now)
+        return next(results)
+
+    mock.side_effect = side_effect
+    return times
+
+
+def test_control_loop_in_call(loop_env, clock):
+    loop_env.detect_call_activity.return_value = True
+    loop_env.ensure_mic_volume.return_value = 60
+    stop_event = _run_until(clock, 1)
+
+    control_loop(_loop_args(), Mock(), stop_event)
+
+    loop_env.ensure_mic_volume.assert_called_once_with(80)
+    # The call just started, so the next call check comes before the next tick
+    stop_event.wait.assert_called_once_with(2)
+
+
+def test_control_loop_not_in_call(loop_env, clock):
+    loop_env.detect_call_activity.return_value = False
+    stop_event = _run_until(clock, 1)
+
+    control_loop(_loop_args(), Mock(), stop_event)
+
+    loop_env.ensure_mic_volume.assert_not_called()
+    # Backs off from the minimum call interval instead of waiting for the idle tick
+    stop_event.wait.assert_called_once_with(3)
+
+
+def test_control_loop_call_check_backoff(loop_env, clock):
+    detect_times = _call_times(clock, loop_env.detect_call_activity, repeat(False))
+
+    control_loop(_loop_args(), Mock(), _run_until(clock, 130))
+
+    # Starts at the minimum interval and backs off by 1.5x up to --call-interval
+    assert detect_times == pytest.approx(
+        [0, 3, 7.5, 14.25, 24.375, 39.5625, 62.34375, 92.34375, 122.34375]
+    )
+
+
+def test_control_loop_call_check_after_state_change(loop_env, clock):
+    detect_times = _call_times(
+        clock, loop_env.detect_call_activity, chain([False, True], repeat(True))
+    )
+    loop_env.ensure_mic_volume.return_value = 80
+
+    control_loop(_loop_args(), Mock(), _run_until(clock, 13))
+
+    # The call starting at 3 resets the backoff to the minimum interval
+    assert detect_times == pytest.approx([0, 3, 5, 8, 12.5])
+
+
+def test_control_loop_skips_volume_check_on_target(loop_env, clock):
+    loop_env.detect_call_activity.return_value = True
+    ensure_times = _call_times(clock, loop_env.ensure_mic_volume, repeat(80))
+
+    control_loop(_loop_args(), Mock(), _run_until(clock, 65))
+
+    # Ticks every 3 seconds, but only verifies the volume every 30
+    assert ensure_times == [0, 30, 60]
+    assert loop_env.ensure_mic_volume.call_args_list == [((80,),)] * 3
+
+
+def test_control_loop_retries_failed_volume_check(loop_env, clock):
+    loop_env.detect_call_activity.return_value = True
+    ensure_times = _call_times(clock, loop_env.ensure_mic_volume, chain([None], repeat(80)))
+
+    control_loop(_loop_args(), Mock(), _run_until(clock, 35))
+
+    # A failed check leaves the volume unknown, so the next tick checks again
+    assert ensure_times == [0, 3, 33]
+
+
+def test_control_loop_rechecks_volume_after_state_change(loop_env, clock):
+    detect_times = _call_times(
+        clock, loop_env.detect_call_activity, chain([True, False, True], repeat(True))
+    )
+    ensure_times = _call_times(clock, loop_env.ensure_mic_volume, repeat(80))
+
+    control_loop(_loop_args(), Mock(), _run_until(clock, 5))
+
+    # The call ends at 2 and starts again at 4, which is checked right away
+    # even though the volume was on target when the first call ended
+    assert detect_times == [0, 2, 4]
+    assert ensure_times == [0, 4]
+
+
+def test_control_loop_detection_overruns_tick(loop_env, clock):
+    def detect(stream, stop_event=None):
+        # Recording for call detection takes longer than an active tick
+        clock.now += 5
+        return True
+
+    loop_env.detect_call_activity.side_effect = detect
+    ensure_times = _call_times(clock, loop_env.ensure_mic_volume, repeat(None))
+
+    control_loop(_loop_args(), Mock(), _run_until(clock, 30))
+
+    # Overrun ticks restart the schedule, without a catch-up tick right after
+    assert ensure_times == pytest.approx([5, 12, 20, 23, 29.5])
+
+
+def test_control_loop_stopped(loop_env):
+    stream = Mock()
+
+    control_loop(_loop_args(), stream, _stop_after(0))
+
+    loop_env.detect_call_activity.assert_not_called()
+    stream.close.assert_called_once_with()
+
+
+def test_control_loop_reopens_stream(loop_env, clock):
+    import sounddevice as sd
+
+    stream, new_stream = Mock(), Mock()
+    loop_env.open_input_stream.return_value = new_stream
+    loop_env.detect_call_activity.side_effect = chain(
+        [sd.PortAudioError("Device unavailable")], repeat(False)
+    )
+
+    control_loop(_loop_args(), stream, _run_until(clock, 4))
+
+    loop_env.reset_input_stream.assert_called_once_with(stream)
+    loop_env.open_input_stream.assert_called_once_with()
+    assert [c.args[0] for c in loop_env.detect_call_activity.call_args_list] == [
+        stream,
+        new_stream,
+    ]
+    new_stream.close.assert_called_once_with()
+
+
+def test_control_loop_device_errors(loop_env, clock, caplog):
+    import sounddevice as sd
+
+    detect_times = []
+
+    def detect(stream, stop_event=None):
+        detect_times.append(clock.now)
+        raise sd.PortAudioError("Device unavailable")
+
+    loop_env.detect_call_activity.side_effect = detect
+
+    with caplog.at_level(logging.INFO):
+        control_loop(_loop_args(), Mock(), _run_until(clock, 7))
+
+    # Retries at the minimum interval, without backing off or reporting a call status
+    assert detect_times == [0, 2, 4, 6]
+    assert loop_env.reset_input_stream.call_count == 4
+    assert "Call status check" not in caplog.text
+
+
+@pytest.mark.parametrize("volume,expected", _VOLUME_CASES)
+def test_ensure_mic_volume_boundaries(mock_runner, volume, expected):
+    if expected:
+        mock_runner.return_value = SimpleNamespace(returncode=0, stdout="60\n")
+    else:
+        mock_runner.side_effect = CalledProcessError(1, "cmd")
+    assert (ensure_mic_volume(volume, runner=mock_runner) is not None) is expected
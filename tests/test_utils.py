@@ -0,0 +1,90 @@
+import os
+import stat
+from pathlib import Path
+
+import pytest
+from pyfakefs.fake_filesystem import set_uid
+
+from mic_control.utils import validate_log_path
+
+# Any non-root user id, so the fake filesystem enforces permission bits
+_USER_ID = 1000
+
+
+def test_validate_log_path_creates_file(fs):
+    fs.create_dir("/logs")
+
+    assert validate_log_path("/logs/mic_control.log") == Path("/logs/mic_control.log")
+    assert Path("/logs/mic_control.log").is_file()
+
+
+def test_validate_log_path_keeps_existing_file(fs):
+    fs.create_file("/logs/mic_control.log", contents="existing entry\n")
+
+    assert validate_log_path("/logs/mic_control.log") == Path("/logs/mic_control.log")
+    assert Path("/logs/mic_control.log").read_text() == "existing entry\n"
+
+
+def test_validate_log_path_creates_parent_directory(fs):
+    assert validate_log_path("/logs/nested/mic_control.log") == Path("/logs/nested/mic_control.log")
+    assert Path("/logs/nested").is_dir()
+
+
+def test_validate_log_path_relative_path(fs):
+    fs.create_dir("/work")
+    os.chdir("/work")
+
+    assert validate_log_path("mic_control.log") == Path("/work/mic_control.log")
+
+
+def test_validate_log_path_is_directory(fs):
+    fs.create_dir("/logs/mic_control.log")
+
+    with pytest.raises(SystemExit, match="exists but is not a regular file"):
+        validate_log_path("/logs/mic_control.log")
+
+
+def test_validate_log_path_is_fifo(tmp_path):
+    # A real FIFO, since opening one for writing blocks until there's a reader
+    os.mkfifo(tmp_path / "mic_control.log")
+
+    with pytest.raises(SystemExit, match="exists but is not a regular file"):
+        validate_log_path(str(tmp_path / "mic_control.log"))
+
+
+def test_validate_log_path_is_device():
+    with pytest.raises(SystemExit, match="exists but is not a regular file"):
+        validate_log_path("/dev/null")
+
+
+def test_validate_log_path_parent_is_file(fs):
+    fs.create_file("/logs")
+
+    with pytest.raises(SystemExit, match="exists but is not a directory"):
+        validate_log_path("/logs/mic_control.log")
+
+
+def test_validate_log_path_no_permission_to_create_directory(fs):
+    fs.create_dir("/restricted", perm_bits=0o555)
+    set_uid(_USER_ID)
+
+    with pytest.raises(SystemExit, match="No permission to create directory"):
+        validate_log_path("/restricted/logs/mic_control.log")
+
+
+def test_validate_log_path_os_error_creating_directory(fs, monkeypatch):
+    def raise_os_error(*args, **kwargs):
+        raise OSError("Disk full")
+
+    monkeypatch.setattr(os, "mkdir", raise_os_error)
+
+    with pytest.raises(SystemExit, match="Could not create directory .*Disk full"):
+        validate_log_path("/logs/mic_control.log")
+
+
+def test_validate_log_path_no_write_permission(fs):
+    fs.create_file("/logs/mic_control.log", st_mode=stat.S_IFREG | 0o444)
+    set_uid(_USER_ID)
+
+    with pytest.raises(SystemExit, match="No write permission for log file"):
+        validate_log_path("/logs/mic_control.log")